@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+r"""# load - A load and throughput harness for crust
+
+Drives  *dough()*  or the CLI's  *__main__()*  from a number of threads
+and processes, and reports how many crusts per  second  were  made,  the
+p50/p95/p99 latency of each call, the peak RSS of the busiest worker,
+and the largest peak RSS among its children (worker processes  and  the
+figlet subprocesses).  Each job draws its block count, *length*,
+*width* and *use_fig* from the distributions given on the command line,
+so the results can also be grouped by one of those parameters to see how
+the cost of a crust scales with it.
+
+FIGlet is never run for real.  A stand-in *figlet* script is written to
+a temporary directory that is put at the front of $PATH,  and  it sleeps
+for *--latency* milliseconds before printing a small banner, so runs are
+repeatable on machines without figlet installed.
+
+The jobs are run once untimed (*--warmup*),  then timed over and over,
+at least *--repeat* times and for at least *--min-time* seconds.  The
+throughput of the run is that of its fastest pass,  since one pass over
+the default 1000 jobs takes only a few milliseconds, and slower passes
+mostly measure whatever else the machine was doing.
+
+A run can be saved as a baseline with *--save*,  and  compared against
+one with *--baseline*,  which must have been made with the same options.
+If the throughput drops by more than *--max-drop* percent (10 by default),
+the run fails with an exit status of 1.
+
+## Distributions
+
+    Each of -b, -l, -w and -f takes a spec:
+        '8'         always 8
+        '2,4,8'     one of 2, 4 or 8, picked uniformly
+        '1..16'     an integer from 1 to 16 inclusive
+
+    -f takes 0 or 1 values, so '0,1' uses figlet for about half the jobs.
+
+## Examples
+
+    python3 bench/load.py -n 2000 -t 8
+    python3 bench/load.py -n 2000 -t 4 -P 4 -b 1..32 --by blocks
+    python3 bench/load.py --target main -f 1 --latency 5 -t 16
+    python3 bench/load.py -n 5000 --save bench/baseline.json
+    python3 bench/load.py -n 5000 --baseline bench/baseline.json --max-drop 10
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import resource
+import stat
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+ego = Path(__file__).resolve()
+# crust.py is a lone module, not an
+# installed package, so make it
+# importable from the source tree
+sys.path.insert(0, str(ego.parent.parent / 'src' / 'crust'))
+
+import crust
+
+################################### !setup  ###################################
+
+# Environment variable the stand-in
+# figlet reads its sleep, in
+# seconds, from
+latency_var = 'CRUST_LOAD_FIG_SLEEP'
+
+# The stand-in figlet, a shell
+# script so it starts about as fast
+# as the real one.  It ignores its
+# options, sleeps, and prints the
+# message between two bars
+fake_figlet = """\
+#!/bin/sh
+sleep "${var}"
+for message; do :; done
+echo "========"
+echo "| $message |"
+echo "========"
+"""
+
+# Percentiles that get reported
+percentiles = (50, 95, 99)
+
+################################### @setup  ###################################
+
+################################## !helpers  ##################################
+
+def spread(spec):
+    """spread - Parse a distribution spec into a tuple of choices
+
+    '8' -> (8,),  '2,4,8' -> (2, 4, 8),  '1..4' -> (1, 2, 3, 4)
+    """
+    try:
+        if '..' in spec:
+            low, high = spec.split('..')
+            choices = tuple(range(int(low), int(high) + 1))
+        else:
+            choices = tuple(int(value) for value in spec.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{!r} is not a valid distribution".format(spec)
+            )
+    if not choices:
+        raise argparse.ArgumentTypeError(
+            "{!r} is an empty range".format(spec)
+            )
+    return choices
+
+def percentile(ordered, p):
+    'Nearest-rank percentile *p* of the sorted sequence *ordered*'
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered)*p // 100))
+    return ordered[int(rank) - 1]
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    'Peak resident set size of *who*, in bytes'
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes,
+    # macOS reports bytes
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return rss
+
+def install_figlet(where, latency):
+    """install_figlet - Put the stand-in figlet at the front of $PATH
+
+    The script is written to the directory *where*,  and its latency
+    is passed through the environment,  so both threads and forked or
+    spawned processes pick it up.  *__main__* restores the environment
+    once the run is over.
+    """
+    fig = Path(where) / 'figlet'
+    fig.write_text(
+        fake_figlet.replace('{var}', latency_var)
+        )
+    fig.chmod(fig.stat().st_mode | stat.S_IXUSR)
+    os.environ[latency_var] = str(latency / 1000)
+    os.environ['PATH'] = crust.cat(
+        str(where), os.pathsep, os.environ.get('PATH', '')
+        )
+
+def make_jobs(rx):
+    """make_jobs - Draw the parameters of every job up front
+
+    Each job is a dict holding the keyword arguments for *dough()*,
+    drawn from the distributions in *rx* using *rx.seed*, so two runs
+    with the same options make the same crusts.
+    """
+    rng = random.Random(rx.seed)
+    jobs = []
+    for n in range(rx.count):
+        blocks = rng.choice(rx.blocks)
+        jobs.append(dict(
+             n=n
+            ,blocks=tuple('block{}'.format(b) for b in range(blocks))
+            ,length=rng.choice(rx.len)
+            ,width=rng.choice(rx.width)
+            ,use_fig=bool(rng.choice(rx.figlet))
+            ))
+    return jobs
+
+################################## @helpers  ##################################
+
+################################### !work  ####################################
+
+def run_dough(job, scratch):
+    'Make one crust in memory'
+    crust.dough(
+         'load{}'.format(job['n'])
+        ,blocks=job['blocks']
+        ,length=job['length']
+        ,width=job['width']
+        ,use_fig=job['use_fig']
+        )
+
+def run_main(job, scratch):
+    'Make one crust on disk through the CLI'
+    args = [
+         str(Path(scratch) / 'load{}.py'.format(job['n']))
+        ,*job['blocks']
+        ,'-r', '-m'
+        ,'-l', str(job['length'])
+        ,'-w', str(job['width'])
+        ]
+    if job['use_fig']:
+        args.append('-f')
+    crust.__main__(*args)
+
+targets = {
+    'dough': run_dough,
+    'main': run_main,
+    }
+
+def timed(target, job, scratch):
+    'Run *job* against *target*, returning its latency in seconds'
+    start = time.perf_counter()
+    targets[target](job, scratch)
+    return time.perf_counter() - start
+
+def work(target, jobs, threads, scratch):
+    """work - Run *jobs* on a pool of *threads* in this process
+
+    Returns a list of (job, latency) pairs and the peak RSS of this
+    process.  This is also the entry point of each worker process.
+    """
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        latencies = pool.map(
+            timed
+            ,[target]*len(jobs)
+            ,jobs
+            ,[scratch]*len(jobs)
+            )
+        results = list(zip(jobs, latencies))
+    return results, peak_rss()
+
+def one_pass(rx, jobs, chunks, scratch, pool):
+    """one_pass - Run every job once, on *pool* if given
+
+    Returns the (job, latency) pairs of every job,  the wall time in
+    seconds, and the peak RSS of the busiest worker.
+    """
+    start = time.perf_counter()
+    if pool is None:
+        results, rss = work(rx.target, jobs, rx.threads, scratch)
+    else:
+        results, rss = [], 0
+        futures = [
+            pool.submit(work, rx.target, chunk, rx.threads, scratch)
+            for chunk in chunks
+            ]
+        for future in futures:
+            part, part_rss = future.result()
+            results += part
+            rss = max(rss, part_rss)
+    wall = time.perf_counter() - start
+    return results, wall, rss
+
+def load(rx, scratch):
+    """load - Spread the jobs over *rx.procs* processes and time them
+
+    Runs *rx.warmup* untimed passes over the jobs, so the worker pool
+    is started and caches are warm, then at least *rx.repeat* timed
+    ones, carrying on until they add up to *rx.min_time* seconds.
+    Returns a list of (results, wall) pairs, one for each timed pass,
+    and the peak RSS of the busiest worker.
+    """
+    jobs = make_jobs(rx)
+    # Give each process every
+    # procs-th job, so they all get
+    # a similar mix
+    chunks = [jobs[p::rx.procs] for p in range(rx.procs)]
+    pool = None
+    if rx.procs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(rx.procs)
+    passes, rss = [], 0
+    try:
+        for n in range(rx.warmup):
+            one_pass(rx, jobs, chunks, scratch, pool)
+        spent = 0.0
+        while len(passes) < rx.repeat or spent < rx.min_time:
+            results, wall, part_rss = one_pass(
+                rx, jobs, chunks, scratch, pool
+                )
+            passes.append((results, wall))
+            spent += wall
+            rss = max(rss, part_rss)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return passes, max(rss, peak_rss())
+
+################################### @work  ####################################
+
+################################# !report  ####################################
+
+def config(rx):
+    'The options of a run that its numbers depend on'
+    return {
+        'target': rx.target,
+        'count': rx.count,
+        'threads': rx.threads,
+        'procs': rx.procs,
+        'blocks': rx.blocks_spec,
+        'len': rx.len_spec,
+        'width': rx.width_spec,
+        'figlet': rx.figlet_spec,
+        'latency': rx.latency,
+        'seed': rx.seed,
+        'warmup': rx.warmup,
+        'repeat': rx.repeat,
+        'min_time': rx.min_time,
+        }
+
+def summarize(rx, passes, rss):
+    """summarize - Collect the numbers of a run into a JSON-friendly dict
+
+    The throughput of a run is that of its fastest pass,  which is the
+    one least disturbed by whatever else the machine was doing, and its
+    latencies are those of every job in every pass.
+    """
+    results = [pair for part, wall in passes for pair in part]
+    ordered = sorted(latency for job, latency in results)
+    throughputs = [len(part) / wall for part, wall in passes if wall]
+    summary = {
+        'config': config(rx),
+        'throughput': max(throughputs, default=0.0),
+        'throughputs': throughputs,
+        'wall': sum(wall for part, wall in passes),
+        'mean': sum(ordered) / len(ordered) if ordered else 0.0,
+        'peak_rss': rss,
+        'peak_rss_children': peak_rss(resource.RUSAGE_CHILDREN),
+        }
+    for p in percentiles:
+        summary['p{}'.format(p)] = percentile(ordered, p)
+    return summary
+
+def group(passes, by):
+    'Sorted latencies of every pass, grouped by the job parameter *by*'
+    key = {
+        'blocks': lambda job: len(job['blocks']),
+        'len': lambda job: job['length'],
+        'width': lambda job: job['width'],
+        'figlet': lambda job: int(job['use_fig']),
+        }[by]
+    groups = {}
+    for job, latency in (pair for part, wall in passes for pair in part):
+        groups.setdefault(key(job), []).append(latency)
+    return {k: sorted(v) for k, v in sorted(groups.items())}
+
+def ms(seconds):
+    return '{:9.3f} ms'.format(seconds*1000)
+
+def mib(size):
+    return '{:9.1f} MiB'.format(size / 2**20)
+
+def report(summary, groups=None, by=None):
+    'Print a run summary, and a table of its groups if given'
+    config = summary['config']
+    print(crust.cat(
+         'target {target}, {count} jobs, {procs} procs x {threads} threads,'
+         ' {warmup} warm-up'.format(**config), '\n'
+        ,'blocks {blocks}, len {len}, width {width}, figlet {figlet}'
+         ' ({latency} ms)'.format(**config), '\n'
+        ))
+    throughputs = sorted(summary['throughputs'])
+    print('  throughput {:9.1f} crusts/s (best of {}, median {:.1f})'.format(
+         summary['throughput']
+        ,len(throughputs)
+        ,percentile(throughputs, 50)
+        ))
+    print('  wall       {:9.3f} s'.format(summary['wall']))
+    print('  mean       ' + ms(summary['mean']))
+    for p in percentiles:
+        key = 'p{}'.format(p)
+        print('  {:<10} {}'.format(key, ms(summary[key])))
+    print('  peak RSS   ' + mib(summary['peak_rss']))
+    print('  child RSS  ' + mib(summary['peak_rss_children']))
+    if groups:
+        print('\n  {:>8} {:>7} {:>12} {:>12} {:>12}'
+              .format(by, 'jobs', 'p50', 'p95', 'p99'))
+        for value, ordered in groups.items():
+            print('  {:>8} {:>7} {} {} {}'.format(
+                 value, len(ordered)
+                ,*(ms(percentile(ordered, p)) for p in percentiles)
+                ))
+
+def compare(summary, baseline, max_drop):
+    """compare - Check a run's throughput against a stored baseline
+
+    Prints the change in throughput and returns False if it dropped by
+    more than *max_drop* percent.  Both runs must have been made with
+    the same options, see *read_baseline*.
+    """
+    then, now = baseline['throughput'], summary['throughput']
+    change = (now - then) / then * 100 if then else 0.0
+    print('\n  baseline   {:9.1f} crusts/s ({:+.1f}%)'.format(then, change))
+    if change < -max_drop:
+        print('FAIL: throughput dropped more than {}%'.format(max_drop))
+        return False
+    return True
+
+def read_baseline(path, rx):
+    """read_baseline - Load a baseline and check it matches *rx*
+
+    Raises ValueError with a message fit for the user if the file can't
+    be read,  isn't a baseline,  or was made with different  options,
+    since throughputs of different runs can't be compared.
+    """
+    try:
+        baseline = json.loads(Path(path).read_text())
+    except OSError as error:
+        raise ValueError(
+            "can't read baseline {}: {}".format(path, error.strerror)
+            )
+    except json.JSONDecodeError as error:
+        raise ValueError(
+            "baseline {} is not valid JSON: {}".format(path, error)
+            )
+    if (not isinstance(baseline, dict)
+            or not isinstance(baseline.get('config'), dict)
+            or not isinstance(baseline.get('throughput'), (int, float))):
+        raise ValueError(
+            "baseline {} has no 'config' and 'throughput'".format(path)
+            )
+    # A zero throughput would let
+    # every run pass the gate
+    if baseline['throughput'] <= 0:
+        raise ValueError(
+            "baseline {} has a throughput of {}, save a new baseline"
+            .format(path, baseline['throughput'])
+            )
+    wanted = config(rx)
+    differ = sorted(
+        key for key in wanted.keys() | baseline['config'].keys()
+        if wanted.get(key) != baseline['config'].get(key)
+        )
+    if differ:
+        raise ValueError(
+            "baseline {} was made with different options ({}), "
+            "rerun with the same options or save a new baseline"
+            .format(path, ', '.join(differ))
+            )
+    return baseline
+
+################################# @report  ####################################
+
+################################### !parser  ##################################
+
+parser = argparse.ArgumentParser(
+    description='load - A load and throughput harness for crust.\n'
+    )
+parser.add_argument(
+     '--target'
+    ,choices=sorted(targets)
+    ,default='dough'
+    ,help="Drive dough() in memory, or __main__() writing files"
+    )
+parser.add_argument(
+     '-n', '--count'
+    ,default=1000
+    ,type=int
+    ,help="Number of crusts to make (default is 1000)"
+    )
+parser.add_argument(
+     '-t', '--threads'
+    ,default=1
+    ,type=int
+    ,help="Threads per process (default is 1)"
+    )
+parser.add_argument(
+     '-P', '--procs'
+    ,default=1
+    ,type=int
+    ,help="Worker processes (default is 1, which runs in this process)"
+    )
+parser.add_argument(
+     '-b', '--blocks'
+    ,dest='blocks_spec'
+    ,default='2'
+    ,help="Distribution of the number of blocks (default is 2)"
+    )
+parser.add_argument(
+     '-l', '--len'
+    ,dest='len_spec'
+    ,default='5'
+    ,help="Distribution of block lengths (default is 5)"
+    )
+parser.add_argument(
+     '-w', '--width'
+    ,dest='width_spec'
+    ,default='80'
+    ,help="Distribution of widths (default is 80)"
+    )
+parser.add_argument(
+     '-f', '--figlet'
+    ,dest='figlet_spec'
+    ,default='0'
+    ,help="Distribution of use_fig, as 0s and 1s (default is 0)"
+    )
+parser.add_argument(
+     '--warmup'
+    ,default=1
+    ,type=int
+    ,help="Untimed passes over the jobs before timing (default is 1)"
+    )
+parser.add_argument(
+     '--repeat'
+    ,default=5
+    ,type=int
+    ,help="Least number of timed passes over the jobs, the best is"
+         " reported (default is 5)"
+    )
+parser.add_argument(
+     '--min-time'
+    ,metavar='seconds'
+    ,default=2.0
+    ,type=float
+    ,help="Keep making timed passes until they take this long"
+         " (default is 2)"
+    )
+parser.add_argument(
+     '--latency'
+    ,default=0.0
+    ,type=float
+    ,help="Milliseconds the stand-in figlet sleeps (default is 0)"
+    )
+parser.add_argument(
+     '--seed'
+    ,default=0
+    ,type=int
+    ,help="Seed for drawing job parameters (default is 0)"
+    )
+parser.add_argument(
+     '--by'
+    ,choices=('blocks', 'len', 'width', 'figlet')
+    ,help="Also report latency grouped by this parameter"
+    )
+parser.add_argument(
+     '--save'
+    ,metavar='file'
+    ,help="Save the run's summary as a JSON baseline"
+    )
+parser.add_argument(
+     '--baseline'
+    ,metavar='file'
+    ,help="Compare the run's throughput against this JSON baseline"
+    )
+parser.add_argument(
+     '--max-drop'
+    ,metavar='percent'
+    ,default=10.0
+    ,type=float
+    ,help="Fail if throughput drops more than this against the baseline"
+         " (default is 10)"
+    )
+
+################################### @parser  ##################################
+
+################################### !main  ####################################
+
+def __main__(*args):
+    if args:
+        rx = parser.parse_args(args)
+    else:
+        rx = parser.parse_args()
+    for name in ('count', 'threads', 'procs', 'repeat'):
+        if getattr(rx, name) < 1:
+            parser.error('--{} must be at least 1'.format(name))
+    if rx.warmup < 0:
+        parser.error('--warmup must not be negative')
+    if rx.min_time < 0:
+        parser.error('--min-time must not be negative')
+    if rx.latency < 0:
+        parser.error('--latency must not be negative')
+    if rx.max_drop < 0:
+        parser.error('--max-drop must not be negative')
+    # Parse the distributions, keeping
+    # the specs for the summary
+    try:
+        rx.blocks = spread(rx.blocks_spec)
+        rx.len = spread(rx.len_spec)
+        rx.width = spread(rx.width_spec)
+        rx.figlet = spread(rx.figlet_spec)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+    # Zero blocks would make the CLI
+    # fall back to its default blocks
+    if min(rx.blocks) < 1:
+        parser.error('--blocks must draw from values of at least 1')
+    if min(rx.len) < 0:
+        parser.error('--len must not draw negative values')
+    if min(rx.width) < 1:
+        parser.error('--width must draw from values of at least 1')
+    if not set(rx.figlet) <= {0, 1}:
+        parser.error('--figlet may only draw from 0 and 1')
+    # Check the baseline and where
+    # to save up front, rather than
+    # after the run
+    if rx.save and not Path(rx.save).parent.is_dir():
+        parser.error(
+            "can't save to {}: {} is not a directory"
+            .format(rx.save, Path(rx.save).parent)
+            )
+    if rx.baseline:
+        try:
+            baseline = read_baseline(rx.baseline, rx)
+        except ValueError as error:
+            parser.error(str(error))
+
+    # The stand-in figlet changes the
+    # environment, put it back after
+    saved = {name: os.environ.get(name) for name in ('PATH', latency_var)}
+    try:
+        with tempfile.TemporaryDirectory(prefix='crust-load-') as scratch:
+            install_figlet(scratch, rx.latency)
+            passes, rss = load(rx, scratch)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    summary = summarize(rx, passes, rss)
+    groups = group(passes, rx.by) if rx.by else None
+    report(summary, groups, rx.by)
+
+    if rx.save:
+        try:
+            Path(rx.save).write_text(json.dumps(summary, indent=4) + '\n')
+        except OSError as error:
+            parser.error(
+                "can't save to {}: {}".format(rx.save, error.strerror)
+                )
+    if rx.baseline:
+        if not compare(summary, baseline, rx.max_drop):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(__main__())
+
+###################################  main  ####################################
+# EOF